@@ -1,6 +1,7 @@
 import random
 from mesa import Agent
 from messaging import TOPIC_PURCHASE_REQ, TOPIC_RESTOCK_REQ, TOPIC_PURCHASE_OK, TOPIC_PURCHASE_FAIL
+from transactions import InventoryLedger
 
 def _title(book_ind):
     # Use rdfs:label if present; otherwise fall back to the name
@@ -15,9 +16,15 @@ class CustomerAgent(Agent):
         self.purchased = []
 
     def step(self):
-        # pick a random book individual
-        book = random.choice(list(self.onto.Book.instances()))
-        qty = random.randint(1, 5)
+        # recommended title (if the model has an index), else a uniformly random one;
+        # model RNG either way, so runs are reproducible under seed
+        book = None
+        rec = getattr(self.model, "recommender", None)
+        if rec is not None and self.random.random() >= getattr(self.model, "explore", 0.0):
+            book = rec.recommend(self.unique_id, self.random)
+        if book is None:
+            book = self.random.choice(getattr(self.model, "books", None) or list(self.onto.Book.instances()))
+        qty = self.random.randint(1, 5)
         self.model.events.append({"step": self.model.step_idx, "type": "purchase_request", "customer": self.unique_id, "book": book.name, "qty": qty})
         self.bus.publish(
             TOPIC_PURCHASE_REQ,
@@ -55,8 +62,9 @@ class EmployeeAgent(Agent):
         title = _title(book) if book else inv.name
         who   = getattr(self, "person", None).name if getattr(self, "person", None) else self.unique_id
 
-        inv.AvailableQuantity = int(inv.AvailableQuantity) + qty
-        print(f"[RESTOCK] {who} restocked {title} +{qty} → {int(inv.AvailableQuantity)}")
+        after = self.model.inv_manager.ledger.restock(inv, qty)
+        if getattr(self.model, "verbose", True):
+            print(f"[RESTOCK] {who} restocked {title} +{qty} → {after}")
 
         if hasattr(self.model, "events"):
             self.model.events.append({
@@ -66,26 +74,49 @@ class EmployeeAgent(Agent):
                 "inventory": inv.name,
                 "book": title,
                 "qty": qty,
-                "after_qty": int(inv.AvailableQuantity),
+                "after_qty": after,
             })
 
     def step(self):
+        if getattr(self.model, "restock_policy", "static") == "forecast":
+            self._order_from_forecast()
+            return
         threshold = getattr(self.model, "restock_threshold", 10)
         target    = getattr(self.model, "restock_target", 30)
-        for inv in list(self.managed):  # only inventories this employee manages
+        # only inventories this employee manages, in a stable order
+        for inv in sorted(self.managed, key=lambda x: x.name):
             q = int(inv.AvailableQuantity)
             if q < threshold:
                 add = target - q
                 if add > 0:
                     self.bus.publish(TOPIC_RESTOCK_REQ, {"inventory_iri": inv.iri, "qty": add})
 
+    def _order_from_forecast(self):
+        # supplier orders; the model lands them lead_time steps later (apply_deliveries)
+        engine = self.model.replenishment
+        managed = sorted(self.managed, key=lambda x: x.name)
+        who = self.person.name if self.person else self.unique_id
+        for inv, qty, arrival in engine.review(managed, self.model.step_idx):
+            if hasattr(self.model, "events"):
+                self.model.events.append({
+                    "step": self.model.step_idx,
+                    "type": "restock_order",
+                    "employee": who,
+                    "inventory": inv.name,
+                    "qty": qty,
+                    "arrival_step": arrival,
+                })
+
 class BookAgent(Agent):
-    def __init__(self, unique_id, model, onto, book_individual):
+    def __init__(self, unique_id, model, onto, book_individual, inventory=None):
         super().__init__(unique_id, model)
         self.onto = onto
         self.book = book_individual
-        self.inventory = next((inv for inv in onto.Inventory.instances()
-                               if self.book in getattr(inv, "Stores", [])), None)
+        if inventory is None:
+            # callers building many agents should pass it; this scan is O(inventories)
+            inventory = next((inv for inv in onto.Inventory.instances()
+                              if self.book in getattr(inv, "Stores", [])), None)
+        self.inventory = inventory
 
     @property
     def title(self):
@@ -111,49 +142,86 @@ class BookAgent(Agent):
         pass
 
 class InventoryManager:
-    """Handles purchases; not a Mesa Agent."""
+    """Handles purchases; not a Mesa Agent.
 
-    def __init__(self, onto, bus):
+    Stock moves through an InventoryLedger, so handle_purchase may be called
+    from several threads at once (e.g. behind a threaded or async bus).
+    """
+
+    def __init__(self, onto, bus, verbose=True):
         self.onto = onto
         self.bus = bus
+        self.verbose = verbose
+        self.ledger = InventoryLedger(onto)
+        # book iri -> (book, inventory), built in one pass over Inventory.Stores;
+        # a per-book search_one is a SQL query each and dominates large catalogs
+        self._inv_of_book = {}
+        for inv in onto.Inventory.instances():
+            for b in getattr(inv, "Stores", []):
+                self._inv_of_book.setdefault(b.iri, (b, inv))
+        self._customers = None
+        self.created_orders = None  # a list here collects new Orders (set by RetentionManager)
         bus.subscribe(TOPIC_PURCHASE_REQ, self.handle_purchase)
 
+    def inventory_of(self, book):
+        """The Inventory storing book, or None."""
+        hit = self._inv_of_book.get(book.iri)
+        return hit[1] if hit else None
+
+    def _lookup(self, book_iri):
+        hit = self._inv_of_book.get(book_iri)
+        if hit is None:
+            onto = self.onto
+            with self.ledger.onto_lock:
+                book = onto.search_one(iri=book_iri)
+                inv = onto.search_one(type=onto.Inventory, Stores=book)
+                if not inv:
+                    # fallback: scan
+                    inv = next((x for x in onto.Inventory.instances() if book in getattr(x, "Stores", [])), None)
+            if not inv:
+                raise RuntimeError(f"No Inventory found for book {book.name}")
+            hit = self._inv_of_book[book_iri] = (book, inv)
+        return hit
+
     def handle_purchase(self, payload):
         onto = self.onto
-        book = onto.search_one(iri=payload["book_iri"])
-        inv = onto.search_one(type=onto.Inventory, Stores=book)
-        if not inv:
-            # fallback: scan
-            inv = next((x for x in onto.Inventory.instances() if book in getattr(x, "Stores", [])), None)
-
-        if not inv:
-            raise RuntimeError(f"No Inventory found for book {book.name}")
-        qty_avail = int(inv.AvailableQuantity)
-
-        if qty_avail >= payload["qty"]:
-            # Create an Order individual for ontology consistency
-            o = onto.Order(
-                f"Order_{payload['customer_id']}_{book.name}_{self._rand()}"
-            )
-            cust = self._customer_from_id(payload["customer_id"])
-            o.HasCustomer = [cust]
-            o.HasBook = [book]
-
-            # Directly assert Purchases relation
-            current = list(getattr(cust, "Purchases", []))
-            cust.Purchases = current + [book]
+        book, inv = self._lookup(payload["book_iri"])
+        ledger = self.ledger
+
+        res = ledger.reserve(inv, payload["qty"])
+        if res is None:
+            if self.verbose:
+                print(
+                    f"[FAIL] Not enough stock for {book.name} (have {ledger.available(inv)})"
+                )
+            self.bus.publish(TOPIC_PURCHASE_FAIL, payload)
+            return
 
-            inv.AvailableQuantity = qty_avail - payload["qty"]
+        try:
+            cust = self._customer_from_id(payload["customer_id"])
+            with ledger.onto_lock:
+                # Create an Order individual for ontology consistency
+                o = onto.Order(
+                    f"Order_{payload['customer_id']}_{book.name}_{self._rand()}"
+                )
+                o.HasCustomer = [cust]
+                o.HasBook = [book]
+                if self.created_orders is not None:
+                    self.created_orders.append(o)
+
+                # Directly assert Purchases relation (append, never replace)
+                cust.Purchases.append(book)
+        except BaseException:
+            ledger.abort(res)
+            raise
+        new_qty = ledger.commit(res)
+
+        if self.verbose:
             title = _title(book)
             print(
-                f"[OK] {cust.name} bought 1x {title}. New qty: {int(inv.AvailableQuantity)}"
+                f"[OK] {cust.name} bought 1x {title}. New qty: {new_qty}"
             )
-            self.bus.publish(TOPIC_PURCHASE_OK, payload)
-        else:
-            print(
-                f"[FAIL] Not enough stock for {book.name} (have {qty_avail})"
-            )
-            self.bus.publish(TOPIC_PURCHASE_FAIL, payload)
+        self.bus.publish(TOPIC_PURCHASE_OK, payload)
 
     def _customer_from_id(self, cid):
         # Map agent ids like "Cust_1", "Cust_2", ... to ontology customers in order.
@@ -161,7 +229,11 @@ class InventoryManager:
             idx = int(str(cid).split("_")[-1]) - 1
         except Exception:
             idx = 0
-        customers = sorted(self.onto.Customer.instances(), key=lambda x: x.name)
+        customers = self._customers
+        if customers is None:
+            with self.ledger.onto_lock:
+                customers = sorted(self.onto.Customer.instances(), key=lambda x: x.name)
+            self._customers = customers
         if not customers:
             raise RuntimeError("No Customer individuals found in ontology.")
         return customers[idx % len(customers)]
@@ -1,38 +1,98 @@
 from mesa import Model
 from mesa.time import RandomActivation
-from ontology import build_ontology, seed_data
+from ontology import build_ontology, seed_catalog
 from rules import add_rules
 from agents import CustomerAgent, EmployeeAgent, InventoryManager, BookAgent
 from messaging import MessageBus
+from replenishment import ReplenishmentEngine, apply_deliveries, format_summary
+from recommend import RecommendationIndex
+from retention import RetentionManager
 
 import csv
+import json
 from pathlib import Path
 
+REPORT_FORMATS = ("csv", "jsonl")
+OWL_FORMATS = ("rdfxml", "ntriples")
+
+
+class EventLog(list):
+    """Per-event rows. With record=False rows are only counted, never kept
+    (pure-throughput runs); total counts every row either way."""
+
+    def __init__(self, record=True):
+        super().__init__()
+        self.record = record
+        self.total = 0
+
+    def append(self, row):
+        self.total += 1
+        if self.record:
+            super().append(row)
+
+    def extend(self, rows):
+        rows = list(rows)
+        self.total += len(rows)
+        if self.record:
+            super().extend(rows)
+
+    def merge(self, rows, total):
+        # rows produced elsewhere (e.g. a shard's EventLog) plus its full count
+        self.total += total
+        if self.record:
+            super().extend(rows)
+
+
+def catalog_spec(n_books, n_customers, n_employees, seed):
+    """seed_catalog() argument: None keeps the hand-written seed_data store."""
+    if n_books is None:
+        return None
+    return dict(n_books=n_books, n_customers=n_customers, n_employees=n_employees,
+                seed=0 if seed is None else seed)
+
+
 class BookstoreModel(Model):
-    def __init__(self, n_customers=3, n_employees=1, steps=30, seed=None, restock_threshold=10, restock_target=30):
+    def __init__(self, n_customers=3, n_employees=1, steps=30, seed=None, restock_threshold=10, restock_target=30,
+                 restock_policy="static", lead_time=2, demand_alpha=0.2, service_z=1.65, holding_cost=1.0,
+                 n_books=None, record_events=True, verbose=True, demand="uniform", explore=0.1,
+                 retention_window=None, archive_dir="archive"):
         super().__init__(seed=seed)
         self.steps = steps
         self.schedule = RandomActivation(self)
         self.bus = MessageBus()
 
-        self.events = []   # per-event rows: {"step": int, "type": ..., "book": ..., "qty": int}
-        self.ts = []       
+        self.events = EventLog(record_events)   # per-event rows: {"step": int, "type": ..., "book": ..., "qty": int}
+        self.ts = []
         self.step_idx = 0
+        self.verbose = verbose
 
-        # Ontology
+        # Ontology (n_books generates a synthetic catalog of that size)
         self.onto = build_ontology()
-        seed_data(self.onto)
+        seed_catalog(self.onto, catalog_spec(n_books, n_customers, n_employees, seed))
         add_rules(self.onto)
 
         # Make policy configurable
         self.restock_threshold = restock_threshold
         self.restock_target = restock_target
+        if restock_policy not in ("static", "forecast"):
+            raise ValueError(f"Unknown restock_policy {restock_policy!r}")
+        self.restock_policy = restock_policy  # "static": threshold/target, instant; "forecast": engine orders with lead time
+
+        # Demand: "uniform" picks any title; "recommend" draws from the
+        # recommendation index, with an `explore` share of uniform picks
+        if demand not in ("uniform", "recommend"):
+            raise ValueError(f"Unknown demand model {demand!r}")
+        self.books = list(self.onto.Book.instances())
+        self.explore = explore
+        self.recommender = RecommendationIndex(self.onto, self.bus) if demand == "recommend" else None
 
-        self.inv_manager = InventoryManager(self.onto, self.bus)
+        self.inv_manager = InventoryManager(self.onto, self.bus, verbose=verbose)
+        self.replenishment = ReplenishmentEngine(self.onto, self.bus, lead_time=lead_time, alpha=demand_alpha,
+                                                 service_z=service_z, holding_cost=holding_cost)
 
         # Agents
         for b in self.onto.Book.instances():
-            ba = BookAgent(f"BookAgent_{b.name}", self, self.onto, b)
+            ba = BookAgent(f"BookAgent_{b.name}", self, self.onto, b, self.inv_manager.inventory_of(b))
             self.schedule.add(ba)
         for i in range(n_customers):
             a = CustomerAgent(f"Cust_{i+1}", self, self.onto, self.bus)
@@ -41,6 +101,9 @@ class BookstoreModel(Model):
             e = EmployeeAgent(f"Emp_{j+1}", self, self.onto, self.bus)
             self.schedule.add(e)
 
+        # Long-run mode: keep only the last retention_window steps in memory
+        self.retention = RetentionManager(self, retention_window, archive_dir) if retention_window else None
+
         self._snapshot()
 
     def _snapshot(self):
@@ -51,29 +114,64 @@ class BookstoreModel(Model):
         self.ts.append(row)
 
     def step(self):
+        # supplier deliveries due this step land before anyone acts
+        apply_deliveries(self)
         self.schedule.step()
         self.step_idx += 1
         self._snapshot()
+        self.replenishment.end_step(self.ts[-1])
+        if self.recommender is not None:
+            self.recommender.refresh()
+        if self.retention is not None:
+            self.retention.step_end(self.step_idx)
 
-    def run(self):
+    def run(self, out_dir=".", owl_format="rdfxml", formats=("csv",)):
+        """Run all steps, then write bms_result.owl (skipped if owl_format is
+        None) and the reports under out_dir/report in the given formats."""
         for _ in range(self.steps):
             self.step()
-        self.onto.save(file="bms_result.owl", format="rdfxml")
-
-        Path("report").mkdir(parents=True, exist_ok=True)
-
-        # events
-        if self.events:
-            with open("report/events.csv", "w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=sorted(set().union(*[e.keys() for e in self.events])))
-                writer.writeheader()
-                writer.writerows(self.events)
-
-        # time series
-        if self.ts:
-            # normalize columns for consistent header
-            all_keys = sorted(set().union(*[r.keys() for r in self.ts]))
-            with open("report/inventory_timeseries.csv", "w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=all_keys)
-                writer.writeheader()
-                writer.writerows(self.ts)
\ No newline at end of file
+        if self.retention is not None:
+            self.retention.close()
+        if owl_format:
+            Path(out_dir).mkdir(parents=True, exist_ok=True)
+            self.onto.save(file=str(Path(out_dir) / "bms_result.owl"), format=owl_format)
+        print(f"[REPLENISHMENT] {format_summary(self.replenishment.summary())}")
+
+        write_reports(self.events, self.ts, Path(out_dir) / "report", formats)
+
+
+def write_reports(events, ts, report_dir="report", formats=("csv",)):
+    """Write the events log and inventory time series into report_dir, as
+    CSV and/or JSON lines."""
+    report_dir = Path(report_dir)
+    for fmt in formats:
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format {fmt!r}")
+    if not formats:
+        return
+    report_dir.mkdir(parents=True, exist_ok=True)
+
+    if "jsonl" in formats:
+        for name, rows in (("events", events), ("inventory_timeseries", ts)):
+            if rows:
+                with open(report_dir / f"{name}.jsonl", "w", encoding="utf-8") as f:
+                    for row in rows:
+                        f.write(json.dumps(row) + "\n")
+    if "csv" not in formats:
+        return
+
+    # events
+    if events:
+        with open(report_dir / "events.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=sorted(set().union(*[e.keys() for e in events])))
+            writer.writeheader()
+            writer.writerows(events)
+
+    # time series
+    if ts:
+        # normalize columns for consistent header
+        all_keys = sorted(set().union(*[r.keys() for r in ts]))
+        with open(report_dir / "inventory_timeseries.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=all_keys)
+            writer.writeheader()
+            writer.writerows(ts)
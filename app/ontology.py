@@ -1,3 +1,5 @@
+import random
+
 from owlready2 import *
 
 def build_ontology():
@@ -36,6 +38,12 @@ def build_ontology():
         class AvailableQuantity(DataProperty, FunctionalProperty):
             domain = [Inventory]; range = [int]
 
+        # Aggregates of Orders compacted away in long runs (see retention.py)
+        class OrderCount(DataProperty, FunctionalProperty):
+            domain = [Customer]; range = [int]
+        class SalesCount(DataProperty, FunctionalProperty):
+            domain = [Book]; range = [int]
+
     return onto
 
 def seed_data(onto):
@@ -222,3 +230,79 @@ def seed_data(onto):
         o2 = onto.Order("Order_Leo_1984");  o2.HasCustomer = [c2];  o2.HasBook = [b2]
 
     return onto
+
+GENRES = ["Fantasy", "Dystopian", "Sci-Fi", "Classic", "Romance", "Satire", "Mystery", "Fiction"]
+
+def seed_synthetic(onto, n_books, n_customers=12, n_employees=2, seed=0):
+    """Generated catalog for scale runs: one Inventory per Book, inventories
+    split into contiguous blocks across employees (like seed_data's 10/10).
+    The same arguments always produce the same catalog."""
+    rng = random.Random(seed)
+    width = max(4, len(str(n_books)))
+    n_authors = max(1, n_books // 5)
+    with onto:
+        invs = []
+        for k in range(1, n_books + 1):
+            b = onto.Book(f"Book_{k:0{width}d}")
+            b.HasAuthor = f"Author {rng.randrange(n_authors) + 1}"
+            b.HasGenre  = rng.choice(GENRES)
+            b.HasPrice  = float(rng.randrange(800, 2000, 50))
+            b.label     = [f"Title {k}"]
+
+            inv = onto.Inventory(f"Inv_{k:0{width}d}")
+            inv.AvailableQuantity = rng.randint(15, 50)
+            inv.Stores = [b]
+            invs.append(inv)
+
+        n_employees = max(1, n_employees)
+        block = -(-len(invs) // n_employees)
+        for j in range(n_employees):
+            e = onto.Employee(f"Emp_{j + 1:0{width}d}")
+            e.WorksAt = invs[j * block:(j + 1) * block]
+
+        for c in range(1, max(1, n_customers) + 1):
+            onto.Customer(f"Cust_{c:0{max(4, len(str(n_customers)))}d}")
+
+    return onto
+
+def seed_slice(onto, spec):
+    """Part of a store, from plain data (see sharding.catalog_slice): some
+    books and their inventories, every employee and customer (WorksAt and
+    Purchases cut down to the slice), and the Orders for the slice's books.
+    Employees and customers keep their order, so Emp_N / Cust_N ids resolve
+    to the same people as in the full store."""
+    with onto:
+        books = {}
+        for name, author, genre, price, label in spec["books"]:
+            b = books[name] = onto.Book(name)
+            b.HasAuthor = author
+            b.HasGenre  = genre
+            b.HasPrice  = price
+            b.label     = list(label)
+
+        invs = {}
+        for name, qty, stores in spec["inventories"]:
+            inv = invs[name] = onto.Inventory(name)
+            inv.AvailableQuantity = qty
+            inv.Stores = [books[b] for b in stores]
+
+        for name, works_at in spec["employees"]:
+            onto.Employee(name).WorksAt = [invs[i] for i in works_at]
+
+        customers = {}
+        for name, purchases in spec["customers"]:
+            c = customers[name] = onto.Customer(name)
+            c.Purchases = [books[b] for b in purchases]
+
+        for name, cust, book in spec["orders"]:
+            o = onto.Order(name)
+            o.HasCustomer = [customers[cust]] if cust else []
+            o.HasBook = [books[book]]
+
+    return onto
+
+def seed_catalog(onto, catalog=None):
+    """seed_data() by default; a dict of seed_synthetic() kwargs generates one instead."""
+    if catalog is None:
+        return seed_data(onto)
+    return seed_synthetic(onto, **catalog)
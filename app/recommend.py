@@ -0,0 +1,196 @@
+import threading
+
+import numpy as np
+
+from messaging import TOPIC_PURCHASE_OK
+
+
+class RecommendationIndex:
+    """Top-K book candidates per customer from co-purchases and genre/author affinity.
+
+    Memory is fixed at construction, whatever the run length:
+
+    - co-purchases: for every book, the `neighbors` most frequent co-purchased
+      books and their counts (two n_books x neighbors arrays). A new pair
+      evicts the weakest neighbour and inherits its count (space-saving), so
+      heavy pairs survive while the row never grows.
+    - customers: a ring buffer of each customer's last `history` purchases
+      (n_customers x history int32).
+    - popularity: one counter per book; the per-genre and global top lists
+      it feeds are recomputed in refresh(), at step boundaries.
+
+    A query touches only the customer's recent books, their neighbour rows
+    and a few short top lists, so it stays well under a millisecond at
+    100k books. Books still in the customer's history are never suggested.
+
+    Purchases may be recorded from several threads (see InventoryManager);
+    one lock serializes updates, refresh and queries.
+    """
+
+    def __init__(self, onto, bus=None, neighbors=32, history=32, top_k=20, genre_top=64,
+                 w_copurchase=1.0, w_author=0.5, w_genre=0.25):
+        self.books = list(onto.Book.instances())
+        self.index = {b.iri: i for i, b in enumerate(self.books)}
+        self.customers = sorted(onto.Customer.instances(), key=lambda x: x.name)
+        self.top_k = top_k
+        self.genre_top = genre_top
+        self.w_copurchase, self.w_author, self.w_genre = w_copurchase, w_author, w_genre
+
+        n, c = len(self.books), max(1, len(self.customers))
+        self.nbr = np.full((n, neighbors), -1, dtype=np.int32)
+        self.nbr_w = np.zeros((n, neighbors), dtype=np.float32)
+        self.hist = np.full((c, history), -1, dtype=np.int32)
+        self._hist_pos = np.zeros(c, dtype=np.int32)
+        self.popularity = np.zeros(n, dtype=np.float32)
+
+        # genre / author as small ints, members grouped CSR-style
+        self.genre_of, self._genre_members, self._genre_ptr = _group(self.books, "HasGenre")
+        self.author_of, self._author_members, self._author_ptr = _group(self.books, "HasAuthor")
+        self._genre_top_lists = []
+        self._rank_decay = 1.0 - np.arange(genre_top, dtype=np.float32) / genre_top
+        self._global_top = np.arange(min(top_k, n), dtype=np.int32)
+        self._lock = threading.Lock()  # bus handlers may run on several threads
+
+        # warm start from the purchases already in the ontology
+        for ci, cust in enumerate(self.customers):
+            for book in getattr(cust, "Purchases", []):
+                i = self.index.get(book.iri)
+                if i is not None:
+                    self._record(ci, i)
+        self.refresh()
+
+        if bus is not None:
+            bus.subscribe(TOPIC_PURCHASE_OK, self.handle_purchase_ok)
+
+    def customer_index(self, customer_id):
+        # Same "Cust_1" -> first Customer (by name) mapping as InventoryManager
+        try:
+            idx = int(str(customer_id).split("_")[-1]) - 1
+        except Exception:
+            idx = 0
+        return idx % len(self.hist)
+
+    def handle_purchase_ok(self, payload):
+        i = self.index.get(payload["book_iri"])
+        if i is not None:
+            with self._lock:
+                self._record(self.customer_index(payload["customer_id"]), i)
+
+    def _record(self, ci, i):
+        # caller holds _lock (or is still in __init__)
+        h = self.hist[ci]
+        prev = np.unique(h[h >= 0])
+        prev = prev[prev != i]
+        if prev.size:
+            self._bump_row(i, prev)
+            self._bump_rows(prev, i)
+        h[self._hist_pos[ci] % len(h)] = i
+        self._hist_pos[ci] += 1
+        self.popularity[i] += 1.0
+
+    def _bump_row(self, a, others):
+        """Count a co-purchase of book a with each of `others` in a's row."""
+        row, w = self.nbr[a], self.nbr_w[a]
+        found = row[:, None] == others[None, :]
+        w[found.any(axis=1)] += 1.0
+        new = others[~found.any(axis=0)]
+        if new.size:
+            # evict the weakest slots; newcomers inherit their counts
+            slots = np.argpartition(w, new.size - 1)[:new.size] if new.size < w.size else np.arange(w.size)
+            new = new[:slots.size]
+            row[slots] = new
+            w[slots] += 1.0
+
+    def _bump_rows(self, rows, b):
+        """Count a co-purchase with book b in each of the (distinct) rows."""
+        nbr, w = self.nbr[rows], self.nbr_w[rows]
+        hit = nbr == b
+        found = hit.any(axis=1)
+        cols = np.where(found, hit.argmax(axis=1), w.argmin(axis=1))
+        self.nbr[rows, cols] = b
+        self.nbr_w[rows, cols] += 1.0
+
+    def refresh(self):
+        """Recompute the popularity top lists (call once per step)."""
+        with self._lock:
+            pop = self.popularity.copy()
+        lists = []
+        for g in range(len(self._genre_ptr) - 1):
+            members = self._genre_members[self._genre_ptr[g]:self._genre_ptr[g + 1]]
+            lists.append(_top(members, pop[members], self.genre_top))
+        global_top = _top(np.arange(len(pop), dtype=np.int32), pop, self.top_k)
+        with self._lock:
+            self._genre_top_lists, self._global_top = lists, global_top
+
+    def top_k_for(self, customer_id, k=None):
+        """(book indices, scores) of up to k candidates, best first; none of
+        them is in the customer's recent history."""
+        k = k or self.top_k
+        with self._lock:
+            return self._top_k_for(self.customer_index(customer_id), k)
+
+    def _top_k_for(self, ci, k):
+        h = self.hist[ci]
+        h = h[h >= 0]
+        if not h.size:
+            return self._global_top[:k], np.ones(min(k, len(self._global_top)), dtype=np.float32)
+
+        parts, weights = [], []
+
+        nb, nw = self.nbr[h].ravel(), self.nbr_w[h].ravel()
+        keep = nb >= 0
+        if keep.any():
+            nw = nw[keep]
+            parts.append(nb[keep])
+            weights.append(self.w_copurchase * nw / nw.max())
+
+        # affinity for each author / genre in proportion to its share of the history
+        authors, counts = np.unique(self.author_of[h], return_counts=True)
+        for a, n in zip(authors, counts):
+            members = self._author_members[self._author_ptr[a]:self._author_ptr[a + 1]]
+            parts.append(members)
+            weights.append(np.full(members.size, self.w_author * n / h.size, dtype=np.float32))
+        genres, counts = np.unique(self.genre_of[h], return_counts=True)
+        for g, n in zip(genres, counts):
+            top = self._genre_top_lists[g]
+            parts.append(top)
+            # rank-decayed so the genre's bestsellers lead
+            weights.append(self._rank_decay[:top.size] * (self.w_genre * n / h.size))
+
+        cand = np.concatenate(parts)
+        uniq, inv = np.unique(cand, return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(weights)).astype(np.float32)
+        # the customer's own books come back through their co-purchase rows
+        # and author/genre lists; drop them before picking the top k
+        keep = ~np.isin(uniq, h)
+        uniq, scores = uniq[keep], scores[keep]
+        if uniq.size > k:
+            sel = np.argpartition(-scores, k - 1)[:k]
+            uniq, scores = uniq[sel], scores[sel]
+        order = np.argsort(-scores, kind="stable")
+        return uniq[order], scores[order]
+
+    def recommend(self, customer_id, rng, k=None):
+        """Draw one book for customer_id, proportional to candidate scores."""
+        idx, scores = self.top_k_for(customer_id, k)
+        if not idx.size:
+            return None
+        return self.books[int(rng.choices(idx.tolist(), weights=scores.tolist())[0])]
+
+
+def _group(books, prop):
+    """Integer group id per book for a data property, plus CSR member lists."""
+    ids = {}
+    of = np.fromiter((ids.setdefault(str(getattr(b, prop, "")), len(ids)) for b in books),
+                     dtype=np.int32, count=len(books))
+    members = np.argsort(of, kind="stable").astype(np.int32)
+    ptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(of, minlength=len(ids)), out=ptr[1:])
+    return of, members, ptr
+
+
+def _top(members, values, n):
+    if members.size > n:
+        sel = np.argpartition(-values, n - 1)[:n]
+        members, values = members[sel], values[sel]
+    return members[np.argsort(-values, kind="stable")]
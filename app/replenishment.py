@@ -0,0 +1,184 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from messaging import TOPIC_PURCHASE_REQ, TOPIC_PURCHASE_FAIL
+from agents import _title
+
+
+class ReplenishmentEngine:
+    """Demand forecasting, reorder levels and supplier lead times per inventory.
+
+    Demand per inventory is smoothed online (exponential smoothing of the
+    per-step requested quantity and of its squared error). From that:
+
+        reorder point   = rate * L     + z * sqrt(var * L)
+        order-up-to     = rate * (L+1) + z * sqrt(var * (L+1))
+
+    with L the lead time in steps. An order placed during step t lands at
+    the start of step t + L; until then it counts as on-order. All state is
+    kept in numpy arrays indexed by inventory, so a step costs a handful of
+    vector ops regardless of catalog size.
+
+    Stockout rate (failed / requested purchases) and holding cost (on-hand
+    units * holding_cost per step) are tracked for every run, whatever
+    restock policy the employees use.
+    """
+
+    def __init__(self, onto, bus, inventories=None, lead_time=2, alpha=0.2, service_z=1.65,
+                 holding_cost=1.0, initial_rate=1.0):
+        if lead_time < 1:
+            raise ValueError("lead_time must be at least 1 step")
+        self.lead_time = int(lead_time)
+        self.alpha = float(alpha)
+        self.service_z = float(service_z)
+        self.holding_cost_rate = float(holding_cost)
+
+        self.inventories = list(onto.Inventory.instances() if inventories is None else inventories)
+        self.index = {inv.name: i for i, inv in enumerate(self.inventories)}
+        self._receiver = {}  # inventory name -> employee name, for delivery events
+        for emp in onto.Employee.instances():
+            for inv in getattr(emp, "WorksAt", []):
+                self._receiver.setdefault(inv.name, emp.name)
+        self._book_idx = {}
+        for i, inv in enumerate(self.inventories):
+            for book in getattr(inv, "Stores", []):
+                self._book_idx[book.iri] = i
+
+        n = len(self.inventories)
+        self.rate = np.full(n, float(initial_rate))   # smoothed demand per step
+        self.var = np.full(n, float(initial_rate))    # smoothed squared forecast error
+        self.on_order = np.zeros(n, dtype=np.int64)
+        self._demand = np.zeros(n)                     # this step's requested qty
+        self._pending = defaultdict(list)              # arrival step -> [(idx, qty)]
+        self._lock = threading.Lock()                  # bus handlers may run on several threads
+
+        # run KPIs
+        self.requests = 0
+        self.stockouts = 0
+        self.holding_cost = 0.0
+        self.orders = 0
+        self.units_ordered = 0
+        self.steps = 0
+
+        bus.subscribe(TOPIC_PURCHASE_REQ, self._on_request)
+        bus.subscribe(TOPIC_PURCHASE_FAIL, self._on_fail)
+
+    def _on_request(self, payload):
+        i = self._book_idx.get(payload["book_iri"])
+        if i is not None:
+            with self._lock:
+                self._demand[i] += payload["qty"]
+                self.requests += 1
+
+    def _on_fail(self, payload):
+        if payload["book_iri"] in self._book_idx:
+            with self._lock:
+                self.stockouts += 1
+
+    def levels(self, idx):
+        """(reorder point, order-up-to level) arrays for inventory indices idx."""
+        L = self.lead_time
+        rate, var = self.rate[idx], self.var[idx]
+        rop = rate * L + self.service_z * np.sqrt(var * L)
+        upto = rate * (L + 1) + self.service_z * np.sqrt(var * (L + 1))
+        return rop, upto
+
+    def review(self, inventories, step):
+        """Place orders for inventories whose position is at or below the
+        reorder point. Returns [(inventory, qty, arrival_step)]."""
+        inventories = [inv for inv in inventories if inv.name in self.index]
+        if not inventories:
+            return []
+        idx = np.fromiter((self.index[inv.name] for inv in inventories), dtype=np.int64, count=len(inventories))
+        on_hand = np.fromiter((int(inv.AvailableQuantity) for inv in inventories), dtype=np.int64, count=len(inventories))
+        position = on_hand + self.on_order[idx]
+        rop, upto = self.levels(idx)
+        qty = np.where(position <= rop, np.ceil(upto - position), 0).astype(np.int64)
+
+        placed = []
+        arrival = step + self.lead_time
+        for k in np.flatnonzero(qty > 0):
+            i, q = int(idx[k]), int(qty[k])
+            self.on_order[i] += q
+            self._pending[arrival].append((i, q))
+            placed.append((inventories[k], q, arrival))
+        self.orders += len(placed)
+        self.units_ordered += int(qty[qty > 0].sum())
+        return placed
+
+    def receive(self, step):
+        """Deliveries due at the start of step: [(inventory, qty)]."""
+        due = self._pending.pop(step, [])
+        for i, q in due:
+            self.on_order[i] -= q
+        return [(self.inventories[i], q) for i, q in due]
+
+    def end_step(self, row):
+        """Fold this step's demand into the forecast and accrue holding cost.
+        row is the model's inventory snapshot {inventory name: qty}."""
+        with self._lock:
+            d, self._demand = self._demand, np.zeros_like(self._demand)
+        err = d - self.rate
+        self.rate += self.alpha * err
+        self.var = (1.0 - self.alpha) * (self.var + self.alpha * err * err)
+
+        on_hand = np.fromiter((row.get(inv.name, 0) for inv in self.inventories), dtype=np.int64, count=len(self.inventories))
+        self.holding_cost += float(on_hand.sum()) * self.holding_cost_rate
+        self.steps += 1
+
+    def summary(self):
+        return summarize({
+            "requests": self.requests,
+            "stockouts": self.stockouts,
+            "holding_cost": self.holding_cost,
+            "orders": self.orders,
+            "units_ordered": self.units_ordered,
+            "steps": self.steps,
+        })
+
+
+def apply_deliveries(model):
+    """Land the supplier deliveries due at the start of model.step_idx.
+
+    Each goes straight into the ledger, exactly once. (A restock_request
+    would be applied by every EmployeeAgent managing the inventory, and
+    several agents can map to the same Employee.)
+    """
+    engine = model.replenishment
+    for inv, qty in engine.receive(model.step_idx):
+        after = model.inv_manager.ledger.restock(inv, qty)
+        who = engine._receiver.get(inv.name, "supplier")
+        book = (getattr(inv, "Stores", []) or [None])[0]
+        title = _title(book) if book else inv.name
+        if getattr(model, "verbose", True):
+            print(f"[RESTOCK] {who} received {title} +{qty} → {after}")
+        model.events.append({
+            "step": model.step_idx,
+            "type": "restock",
+            "employee": who,
+            "inventory": inv.name,
+            "book": title,
+            "qty": qty,
+            "after_qty": after,
+        })
+
+
+def summarize(totals):
+    out = dict(totals)
+    out["stockout_rate"] = out["stockouts"] / out["requests"] if out["requests"] else 0.0
+    return out
+
+
+def merge_summaries(summaries):
+    """Combine per-shard summaries into one run summary."""
+    keys = ("requests", "stockouts", "holding_cost", "orders", "units_ordered")
+    totals = {k: sum(s[k] for s in summaries) for k in keys}
+    totals["steps"] = max((s["steps"] for s in summaries), default=0)
+    return summarize(totals)
+
+
+def format_summary(s):
+    return (f"stockout rate {s['stockout_rate']:.1%} ({s['stockouts']}/{s['requests']} requests), "
+            f"holding cost {s['holding_cost']:.1f}, {s['orders']} orders / {s['units_ordered']} units")
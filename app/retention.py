@@ -0,0 +1,170 @@
+import csv
+import gzip
+import json
+from collections import deque
+from pathlib import Path
+
+from owlready2 import destroy_entity
+
+
+class RetentionManager:
+    """Rolling retention window for long runs.
+
+    Every `window` steps, anything older than the last `window` steps leaves
+    memory:
+
+    - events and ts rows are appended to gzipped files in archive_dir
+      (events.jsonl.gz, inventory_timeseries.csv.gz);
+    - Order individuals are written to orders.csv.gz and destroyed. Each one
+      is folded into Customer.OrderCount and Book.SalesCount, and the
+      customer's Purchases is deduplicated.
+
+    So memory holds between window and 2 * window steps of history however
+    long the run is. Each gzip append is a separate member; gzip and pandas
+    read the files as one stream.
+
+    A previous run's archive in archive_dir is removed first (reset=True), so
+    the files only ever hold this run. Pass reset=False when several managers
+    share the directory and its owner has already called reset_archive().
+    """
+
+    def __init__(self, model, window, archive_dir="archive", trim_logs=True, compact_orders=True, tag="",
+                 reset=True):
+        if window < 1:
+            raise ValueError("retention window must be at least 1 step")
+        self.model = model
+        self.window = int(window)
+        self.archive_dir = Path(archive_dir)
+        if reset:
+            reset_archive(self.archive_dir)
+        else:
+            self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.trim_logs = trim_logs
+        self.tag = tag
+        self._ts_header = None
+        self._closed = False
+
+        self._orders = deque()  # (step, [Order, ...]) in step order
+        self.inv_manager = model.inv_manager if compact_orders else None
+        if self.inv_manager is not None:
+            self.inv_manager.created_orders = []
+        self.orders_compacted = 0
+
+    def _path(self, name):
+        # orders.csv.gz -> orders_shard0.csv.gz
+        if self.tag:
+            stem, ext = name.split(".", 1)
+            name = f"{stem}_{self.tag}.{ext}"
+        return self.archive_dir / name
+
+    def step_end(self, step):
+        """Call after each step's snapshot; step is the model's new step_idx."""
+        if self.inv_manager is not None and self.inv_manager.created_orders:
+            # orders made during the step that just ended (events carry step - 1)
+            self._orders.append((step - 1, self.inv_manager.created_orders))
+            self.inv_manager.created_orders = []
+        if step % self.window == 0:
+            cutoff = step - self.window
+            if self.trim_logs:
+                self._trim(cutoff)
+            if self.inv_manager is not None:
+                self._compact_orders(cutoff)
+
+    def _trim(self, cutoff):
+        events, ts = self.model.events, self.model.ts
+        n = 0
+        while n < len(events) and events[n]["step"] < cutoff:
+            n += 1
+        self._write_events(events[:n])
+        del events[:n]
+
+        n = 0
+        while n < len(ts) and ts[n]["step"] < cutoff:
+            n += 1
+        self._write_ts(ts[:n])
+        del ts[:n]
+
+    def _write_events(self, rows):
+        if not rows:
+            return
+        with gzip.open(self._path("events.jsonl.gz"), "at", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+    def _write_ts(self, rows):
+        if not rows:
+            return
+        if self._ts_header is None:
+            self._ts_header = sorted(set().union(*[r.keys() for r in rows]))
+            header = True
+        else:
+            header = False
+        with gzip.open(self._path("inventory_timeseries.csv.gz"), "at", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=self._ts_header)
+            if header:
+                writer.writeheader()
+            writer.writerows(rows)
+
+    def _compact_orders(self, cutoff, destroy=True):
+        """Archive the Orders made before step cutoff. With destroy=False they
+        are only written out and stay in the ontology, uncounted."""
+        if not self._orders or self._orders[0][0] >= cutoff:
+            return
+        rows, touched = [], set()
+        with self.inv_manager.ledger.onto_lock:
+            while self._orders and self._orders[0][0] < cutoff:
+                step, orders = self._orders.popleft()
+                for o in orders:
+                    cust = (getattr(o, "HasCustomer", []) or [None])[0]
+                    book = (getattr(o, "HasBook", []) or [None])[0]
+                    rows.append((o.name, cust.name if cust else "", book.name if book else "", step))
+                    if not destroy:
+                        continue
+                    if cust is not None:
+                        cust.OrderCount = (cust.OrderCount or 0) + 1
+                        touched.add(cust)
+                    if book is not None:
+                        book.SalesCount = (book.SalesCount or 0) + 1
+                    destroy_entity(o)
+            for cust in touched:
+                unique = list(dict.fromkeys(cust.Purchases))
+                if len(unique) != len(cust.Purchases):
+                    cust.Purchases = unique
+
+        path = self._path("orders.csv.gz")
+        header = not path.exists()
+        with gzip.open(path, "at", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(["order", "customer", "book", "step"])
+            writer.writerows(rows)
+        if destroy:
+            self.orders_compacted += len(rows)
+
+    def close(self):
+        """Archive whatever is still in memory (events, ts and the live Orders),
+        so the archive covers the whole run. The in-memory window is left
+        intact for the final reports and the ontology export."""
+        if self._closed:
+            return
+        if self.trim_logs:
+            self._write_events(self.model.events)
+            self._write_ts(self.model.ts)
+        if self.inv_manager is not None:
+            if self.inv_manager.created_orders:
+                self._orders.append((self.model.step_idx, self.inv_manager.created_orders))
+                self.inv_manager.created_orders = []
+            self._compact_orders(float("inf"), destroy=False)
+        self._closed = True
+
+
+ARCHIVE_FILES = ("events*.jsonl.gz", "inventory_timeseries*.csv.gz", "orders*.csv.gz")
+
+
+def reset_archive(archive_dir):
+    """Create archive_dir, removing any archive files a previous run left there."""
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    for pattern in ARCHIVE_FILES:
+        for path in archive_dir.glob(pattern):
+            path.unlink()
@@ -1,6 +1,165 @@
-from model import BookstoreModel
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from model import BookstoreModel, OWL_FORMATS, REPORT_FORMATS
+
+
+def rss_mb(max_rss):
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None without `resource`."""
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    return rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def format_rss(m):
+    """Peak RSS for the [PERF] line. Sharded runs add up each worker's own
+    peak (RUSAGE_CHILDREN would only give the largest one); the peaks need
+    not coincide, so the sum is an upper bound on the concurrent footprint."""
+    rss = peak_rss_mb()
+    if rss is None:
+        return ""
+    workers = [rss_mb(x) for x in getattr(m, "worker_max_rss", [])]
+    if not workers:
+        return f", peak RSS {rss:.1f} MB"
+    return (f", peak RSS {rss + sum(workers):.1f} MB summed over processes "
+            f"(coordinator {rss:.1f} + {len(workers)} workers {sum(workers):.1f})")
+
+
+def int_at_least(lo):
+    def parse(value):
+        try:
+            n = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+        if n < lo:
+            raise argparse.ArgumentTypeError(f"must be at least {lo}, got {n}")
+        return n
+    parse.__name__ = "int"  # argparse names the type in its errors
+    return parse
+
+
+positive_int = int_at_least(1)
+non_negative_int = int_at_least(0)
+
+
+def unit_float(value):
+    try:
+        x = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid float value: {value!r}")
+    if not 0.0 <= x <= 1.0:
+        raise argparse.ArgumentTypeError(f"must be between 0 and 1, got {x}")
+    return x
+
+
+def parse_formats(value):
+    if value == "none":
+        return ()
+    formats = tuple(f for f in value.split(",") if f)
+    for f in formats:
+        if f not in REPORT_FORMATS:
+            raise argparse.ArgumentTypeError(f"unknown format {f!r} (choose from {', '.join(REPORT_FORMATS)} or none)")
+    return formats
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Run the MAS bookstore simulation headless (no Streamlit needed).")
+    g = p.add_argument_group("scale")
+    g.add_argument("--books", type=positive_int, default=None,
+                   help="generate a synthetic catalog of this many books (default: the built-in 20-book store)")
+    g.add_argument("--customers", type=positive_int, default=12)
+    g.add_argument("--employees", type=positive_int, default=2)
+    g.add_argument("--steps", type=non_negative_int, default=40)
+    g.add_argument("--seed", type=int, default=42, help="-1 for an unseeded run")
+    g.add_argument("--shards", type=non_negative_int, default=0,
+                   help="worker processes partitioned by inventory (0: single process). An employee's "
+                        "inventories stay on one shard, so at most one shard per store employee runs "
+                        "(--employees with --books; two on the built-in store); more are lowered with a warning")
+    g.add_argument("--demand", choices=("uniform", "recommend"), default="uniform",
+                   help="how customers pick titles: uniformly, or from the recommendation index")
+    g.add_argument("--explore", type=unit_float, default=0.1,
+                   help="share of uniformly random picks under --demand recommend")
+
+    g = p.add_argument_group("restock policy")
+    g.add_argument("--restock-policy", choices=("static", "forecast"), default="static")
+    g.add_argument("--restock-threshold", type=non_negative_int, default=10)
+    g.add_argument("--restock-target", type=non_negative_int, default=30)
+    g.add_argument("--lead-time", type=positive_int, default=2, help="supplier lead time in steps (forecast policy)")
+    g.add_argument("--demand-alpha", type=unit_float, default=0.2, help="demand smoothing factor (forecast policy)")
+    g.add_argument("--service-z", type=float, default=1.65, help="safety stock factor (forecast policy)")
+    g.add_argument("--holding-cost", type=float, default=1.0, help="cost per unit on hand per step")
+
+    g = p.add_argument_group("output")
+    g.add_argument("--out-dir", default=".", help="bms_result.owl and report/ go here")
+    g.add_argument("--formats", type=parse_formats, default=("csv",),
+                   help="comma-separated report formats: csv, jsonl, or none")
+    g.add_argument("--owl-format", choices=OWL_FORMATS, default="rdfxml")
+    g.add_argument("--no-owl", action="store_true", help="skip the ontology export")
+    g.add_argument("--no-events", action="store_true", help="count events but do not keep or write them")
+    g.add_argument("-q", "--quiet", action="store_true", help="no per-purchase/restock log lines")
+
+    g = p.add_argument_group("long runs")
+    g.add_argument("--retention-window", type=positive_int, default=None,
+                   help="keep only this many recent steps of events/ts/Orders in memory; older ones are archived")
+    g.add_argument("--archive-dir", default=None, help="where archived history goes (default: OUT_DIR/archive)")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    kwargs = dict(
+        n_customers=args.customers,
+        n_employees=args.employees,
+        steps=args.steps,
+        seed=None if args.seed < 0 else args.seed,
+        restock_threshold=args.restock_threshold,
+        restock_target=args.restock_target,
+        restock_policy=args.restock_policy,
+        lead_time=args.lead_time,
+        demand_alpha=args.demand_alpha,
+        service_z=args.service_z,
+        holding_cost=args.holding_cost,
+        n_books=args.books,
+        record_events=not args.no_events,
+        verbose=not args.quiet,
+        demand=args.demand,
+        explore=args.explore,
+        retention_window=args.retention_window,
+        archive_dir=args.archive_dir or str(Path(args.out_dir) / "archive"),
+    )
+
+    t0 = time.perf_counter()
+    if args.shards:
+        from sharding import ShardedBookstoreModel
+        m = ShardedBookstoreModel(n_shards=args.shards, **kwargs)
+    else:
+        m = BookstoreModel(**kwargs)
+    t_setup = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    m.run(out_dir=args.out_dir, owl_format=None if args.no_owl else args.owl_format, formats=args.formats)
+    elapsed = time.perf_counter() - t0
+
+    print(
+        f"[PERF] setup {t_setup:.2f}s, run {elapsed:.2f}s for {m.steps} steps: "
+        f"{m.steps / elapsed:.1f} steps/s, {m.events.total / elapsed:.1f} events/s ({m.events.total} events)"
+        + format_rss(m)
+    )
+    if not args.no_owl:
+        print(f"Simulation complete. Ontology saved under {args.out_dir}")
+    else:
+        print("Simulation complete.")
+
 
 if __name__ == "__main__":
-    m = BookstoreModel(n_customers=12, n_employees=2, steps=40, seed=42, restock_threshold=10, restock_target=30)
-    m.run()
-    print("Simulation complete. Ontology saved to bms_result.owl")
+    main()
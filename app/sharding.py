@@ -0,0 +1,409 @@
+import multiprocessing as mp
+import os
+import queue
+import random
+import traceback
+import warnings
+from pathlib import Path
+
+from mesa import Model
+from mesa.time import RandomActivation
+from ontology import build_ontology, seed_catalog, seed_slice
+from rules import add_rules
+from agents import CustomerAgent, EmployeeAgent, InventoryManager
+from messaging import MessageBus, TOPIC_PURCHASE_REQ, TOPIC_PURCHASE_OK
+from model import EventLog, catalog_spec, write_reports
+from replenishment import ReplenishmentEngine, apply_deliveries, merge_summaries, format_summary
+from recommend import RecommendationIndex
+from retention import RetentionManager, reset_archive
+
+
+def owner_groups(onto):
+    """Inventories that must share a shard: each employee's WorksAt set
+    (first claim wins), then every inventory nobody works at on its own."""
+    groups, claimed = [], set()
+    for emp in onto.Employee.instances():
+        group = [inv for inv in getattr(emp, "WorksAt", []) if inv.name not in claimed]
+        if group:
+            claimed.update(inv.name for inv in group)
+            groups.append(group)
+    for inv in onto.Inventory.instances():
+        if inv.name not in claimed:
+            groups.append([inv])
+    return groups
+
+
+def partition_inventories(onto, n_shards):
+    """Map inventory name -> shard index.
+
+    Each owner group stays on one shard, so restocking never crosses a
+    process boundary; groups are dealt round-robin.
+    """
+    owner = {}
+    for k, group in enumerate(owner_groups(onto)):
+        for inv in group:
+            owner[inv.name] = k % n_shards
+    return owner
+
+
+def catalog_slices(onto, owner, n_shards):
+    """What each shard needs of the store, as plain data for seed_slice():
+    the books and inventories it owns, plus every employee and customer
+    with WorksAt / Purchases limited to those. A worker seeds only its
+    slice, so its memory follows its share of the catalog, not all of it."""
+    slices = [dict(books=[], inventories=[], employees=[], customers=[], orders=[]) for _ in range(n_shards)]
+    shard_of_book = {}
+    for inv in onto.Inventory.instances():
+        s = owner[inv.name]
+        stores = list(getattr(inv, "Stores", []))
+        for b in stores:
+            if b.name not in shard_of_book:
+                shard_of_book[b.name] = s
+                slices[s]["books"].append((b.name, b.HasAuthor, b.HasGenre, b.HasPrice, list(b.label)))
+        slices[s]["inventories"].append((inv.name, inv.AvailableQuantity, [b.name for b in stores]))
+
+    for e in onto.Employee.instances():
+        works_at = [i.name for i in getattr(e, "WorksAt", [])]
+        for s, sl in enumerate(slices):
+            sl["employees"].append((e.name, [i for i in works_at if owner[i] == s]))
+    for c in onto.Customer.instances():
+        purchases = [b.name for b in getattr(c, "Purchases", [])]
+        for s, sl in enumerate(slices):
+            sl["customers"].append((c.name, [b for b in purchases if shard_of_book.get(b) == s]))
+    for o in onto.Order.instances():
+        book = (getattr(o, "HasBook", []) or [None])[0]
+        cust = (getattr(o, "HasCustomer", []) or [None])[0]
+        if book is not None and book.name in shard_of_book:
+            slices[shard_of_book[book.name]]["orders"].append((o.name, cust.name if cust else "", book.name))
+    return slices
+
+
+def employee_shard(unique_id, onto, owner):
+    # Same Emp_1 -> first Employee mapping as EmployeeAgent; the agent goes
+    # where that person's inventories are
+    emps = list(onto.Employee.instances())
+    if not emps:
+        return 0
+    try:
+        idx = int(str(unique_id).split("_")[-1]) - 1
+    except Exception:
+        idx = 0
+    works_at = getattr(emps[idx % len(emps)], "WorksAt", [])
+    return owner[works_at[0].name] if works_at else 0
+
+
+class ShardModel(Model):
+    """One worker's slice of the store (see catalog_slices): its inventories,
+    their employees and an InventoryManager. Runs inside a worker process."""
+
+    def __init__(self, shard_id, employee_ids, catalog_slice, seed=None, restock_threshold=10, restock_target=30,
+                 restock_policy="static", replenishment_kwargs=None, record_events=True, verbose=True,
+                 report_purchases=False, retention_window=None, archive_dir="archive"):
+        super().__init__(seed=seed)
+        self.shard_id = shard_id
+        self.bus = MessageBus()
+        self.events = EventLog(record_events)
+        self.step_idx = 0
+        self.verbose = verbose
+
+        self.onto = build_ontology()
+        seed_slice(self.onto, catalog_slice)
+        add_rules(self.onto)
+
+        self.restock_threshold = restock_threshold
+        self.restock_target = restock_target
+        self.restock_policy = restock_policy
+
+        self.owned = list(self.onto.Inventory.instances())
+
+        self.inv_manager = InventoryManager(self.onto, self.bus, verbose=verbose)
+        self.replenishment = ReplenishmentEngine(self.onto, self.bus, inventories=self.owned,
+                                                 **(replenishment_kwargs or {}))
+        self.employees = [EmployeeAgent(eid, self, self.onto, self.bus) for eid in employee_ids]
+
+        # successful purchases go back to the coordinator (its recommender learns from them)
+        self._purchases = []
+        if report_purchases:
+            self.bus.subscribe(TOPIC_PURCHASE_OK, self._purchases.append)
+
+        # events leave every step anyway; only Orders need compacting here
+        self.retention = None
+        if retention_window:
+            self.retention = RetentionManager(self, retention_window, archive_dir, trim_logs=False,
+                                              tag=f"shard{shard_id}", reset=False)
+
+    def snapshot(self):
+        return {inv.name: int(inv.AvailableQuantity) for inv in self.owned}
+
+    def step(self, requests):
+        apply_deliveries(self)
+        # purchases routed here this step, in the coordinator's order
+        for payload in requests:
+            self.bus.publish(TOPIC_PURCHASE_REQ, payload)
+        for e in self.employees:
+            e.step()
+        self.step_idx += 1
+        snap = self.snapshot()
+        self.replenishment.end_step(snap)
+        if self.retention is not None:
+            self.retention.step_end(self.step_idx)
+        events, self.events = self.events, EventLog(self.events.record)
+        purchases, self._purchases[:] = list(self._purchases), []
+        return list(events), events.total, purchases, snap
+
+
+def _max_rss():
+    """This process's peak RSS in ru_maxrss units, or None if unknown.
+
+    On Linux ru_maxrss survives execve, so a spawned worker would report
+    at least the coordinator's peak at fork time; VmHWM is this process's
+    own high-water mark (kB, like ru_maxrss there)."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _shard_worker(shard_id, n_shards, employee_ids, shard_kwargs, inbox, outbox):
+    # Every reply is ("ok", value) or ("error", traceback); the coordinator
+    # re-raises the latter instead of waiting forever.
+    try:
+        # global random only names Order individuals; seed it per shard anyway
+        seed = shard_kwargs.get("seed")
+        random.seed(None if seed is None else seed * n_shards + shard_id)
+        # the slice comes as the first message: in the spawn args a large one
+        # blocks start() until this process has finished importing
+        catalog_slice = inbox.get()
+        shard = ShardModel(shard_id, employee_ids, catalog_slice, **shard_kwargs)
+        outbox.put(("ok", shard.snapshot()))
+        while True:
+            msg = inbox.get()
+            if msg[0] == "step":
+                outbox.put(("ok", shard.step(msg[1])))
+            elif msg[0] == "stop":
+                if shard.retention is not None:
+                    shard.retention.close()
+                owl_path, owl_format = msg[1], msg[2]
+                if owl_path:
+                    shard.onto.save(file=owl_path, format=owl_format)
+                outbox.put(("ok", (shard.replenishment.summary(), _max_rss())))
+                return
+    except BaseException:
+        outbox.put(("error", traceback.format_exc()))
+
+
+class ShardedBookstoreModel(Model):
+    """BookstoreModel split across worker processes by inventory.
+
+    Customers run here and publish purchase requests as usual; the bus routes
+    each one to the shard that owns the book's inventory. Shards handle their
+    purchases, then their employees restock, and the coordinator merges the
+    shard events and snapshots (in shard order) at every step boundary, so
+    ts/events are identical for a given seed and shard count.
+
+    An employee's inventories never span shards, so at most one shard per
+    owner group (see owner_groups) has work: on the seed store that is two.
+    n_shards is capped there, with a RuntimeWarning, rather than starting
+    idle workers; more employees allow more shards.
+
+    Only the coordinator holds the whole catalog (routing, customers, the
+    recommender); each worker seeds just its slice (catalog_slices).
+    """
+
+    poll_timeout = 1.0  # seconds between worker liveness checks
+
+    def __init__(self, n_customers=3, n_employees=1, steps=30, seed=None, restock_threshold=10, restock_target=30,
+                 restock_policy="static", lead_time=2, demand_alpha=0.2, service_z=1.65, holding_cost=1.0,
+                 n_books=None, record_events=True, verbose=True, demand="uniform", explore=0.1,
+                 retention_window=None, archive_dir="archive", n_shards=None):
+        super().__init__(seed=seed)
+        self.steps = steps
+        self.schedule = RandomActivation(self)
+        self.bus = MessageBus()
+
+        self.events = EventLog(record_events)
+        self.ts = []
+        self.step_idx = 0
+        self.replenishment_summary = None
+        self.worker_max_rss = []  # each worker's own ru_maxrss, reported when it stops
+
+        # Fail here, before any worker exists, on what a shard would reject
+        if restock_policy not in ("static", "forecast"):
+            raise ValueError(f"Unknown restock_policy {restock_policy!r}")
+        if demand not in ("uniform", "recommend"):
+            raise ValueError(f"Unknown demand model {demand!r}")
+        if lead_time < 1:
+            raise ValueError("lead_time must be at least 1 step")
+        if retention_window is not None and retention_window < 1:
+            raise ValueError("retention window must be at least 1 step")
+        if n_books is not None and n_books < 1:
+            raise ValueError("n_books must be at least 1")
+        if n_shards is not None and n_shards < 1:
+            raise ValueError("n_shards must be at least 1")
+        catalog = catalog_spec(n_books, n_customers, n_employees, seed)
+        shard_kwargs = dict(
+            seed=seed, restock_threshold=restock_threshold, restock_target=restock_target,
+            restock_policy=restock_policy, record_events=record_events, verbose=verbose,
+            report_purchases=demand == "recommend",
+            retention_window=retention_window, archive_dir=str(archive_dir),
+            replenishment_kwargs=dict(lead_time=lead_time, alpha=demand_alpha, service_z=service_z,
+                                      holding_cost=holding_cost),
+        )
+
+        # Catalog + routing table only; inventory state lives in the shards
+        self.onto = build_ontology()
+        seed_catalog(self.onto, catalog)
+        self.books = list(self.onto.Book.instances())
+        self.explore = explore
+        self.recommender = RecommendationIndex(self.onto, self.bus) if demand == "recommend" else None
+
+        inventories = list(self.onto.Inventory.instances())
+        if n_shards is None:
+            n_shards = os.cpu_count() or 1
+        n_groups = len(owner_groups(self.onto))
+        self.n_shards = max(1, min(int(n_shards), n_groups))
+        if self.n_shards < n_shards:
+            warnings.warn(f"running {self.n_shards} shards instead of {n_shards}: the store has only {n_groups} "
+                          f"owner groups (one per employee); add employees to use more processes",
+                          RuntimeWarning, stacklevel=2)
+
+        owner = partition_inventories(self.onto, self.n_shards)
+        self._shard_of = {}
+        for inv in inventories:
+            for book in getattr(inv, "Stores", []):
+                self._shard_of[book.iri] = owner[inv.name]
+        self._batches = [[] for _ in range(self.n_shards)]
+        self.bus.subscribe(TOPIC_PURCHASE_REQ, self._route)
+
+        for i in range(n_customers):
+            a = CustomerAgent(f"Cust_{i+1}", self, self.onto, self.bus)
+            self.schedule.add(a)
+
+        emp_ids = [[] for _ in range(self.n_shards)]
+        for j in range(n_employees):
+            eid = f"Emp_{j+1}"
+            emp_ids[employee_shard(eid, self.onto, owner)].append(eid)
+
+        # one reset for the whole run, before any shard can write its orders file
+        if retention_window:
+            reset_archive(archive_dir)
+
+        # spawn, not fork: each worker needs its own owlready2 world
+        ctx = mp.get_context("spawn")
+        self._inboxes, self._outboxes, self._procs = [], [], []
+        for s in range(self.n_shards):
+            inbox, outbox = ctx.Queue(), ctx.Queue()
+            p = ctx.Process(
+                target=_shard_worker,
+                args=(s, self.n_shards, emp_ids[s], shard_kwargs, inbox, outbox),
+                daemon=True,
+            )
+            p.start()
+            self._inboxes.append(inbox)
+            self._outboxes.append(outbox)
+            self._procs.append(p)
+        # built while the workers are still importing
+        for inbox, catalog_slice in zip(self._inboxes, catalog_slices(self.onto, owner, self.n_shards)):
+            inbox.put(catalog_slice)
+
+        row = {"step": self.step_idx}
+        for s in range(self.n_shards):
+            row.update(self._receive(s))
+        self.ts.append(row)
+
+        # Orders are compacted in the shards; the coordinator rolls ts/events
+        self.retention = None
+        if retention_window:
+            self.retention = RetentionManager(self, retention_window, archive_dir, compact_orders=False,
+                                              reset=False)
+
+    def _receive(self, s):
+        """Next reply from shard s; raises if it failed or died, never hangs."""
+        outbox, p = self._outboxes[s], self._procs[s]
+        while True:
+            try:
+                status, value = outbox.get(timeout=self.poll_timeout)
+                break
+            except queue.Empty:
+                if not p.is_alive():
+                    self._terminate()
+                    raise RuntimeError(f"Shard {s} exited unexpectedly (exit code {p.exitcode})")
+        if status == "error":
+            self._terminate()
+            raise RuntimeError(f"Shard {s} failed:\n{value}")
+        return value
+
+    def _terminate(self):
+        for p in self._procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        self._inboxes, self._outboxes, self._procs = [], [], []
+
+    def _route(self, payload):
+        shard = self._shard_of.get(payload["book_iri"])
+        if shard is None:
+            raise RuntimeError(f"No Inventory found for book {payload['book_iri']}")
+        self._batches[shard].append(payload)
+
+    def step(self):
+        self._batches = [[] for _ in range(self.n_shards)]
+        self.schedule.step()  # customers publish into per-shard batches
+        for inbox, batch in zip(self._inboxes, self._batches):
+            inbox.put(("step", batch))
+
+        self.step_idx += 1
+        row = {"step": self.step_idx}
+        purchases = []
+        for s in range(self.n_shards):
+            events, n_events, shard_purchases, snap = self._receive(s)
+            self.events.merge(events, n_events)
+            purchases.extend(shard_purchases)
+            row.update(snap)
+        self.ts.append(row)
+
+        for payload in purchases:
+            self.bus.publish(TOPIC_PURCHASE_OK, payload)
+        if self.recommender is not None:
+            self.recommender.refresh()
+        if self.retention is not None:
+            self.retention.step_end(self.step_idx)
+
+    def close(self, out_dir=".", owl_format=None):
+        """Stop the workers and merge their replenishment summaries; with an
+        owl_format each writes out_dir/bms_result_shard<N>.owl."""
+        if owl_format:
+            Path(out_dir).mkdir(parents=True, exist_ok=True)
+        for s, inbox in enumerate(self._inboxes):
+            owl_path = str(Path(out_dir) / f"bms_result_shard{s}.owl") if owl_format else None
+            inbox.put(("stop", owl_path, owl_format))
+        summaries, self.worker_max_rss = [], []
+        for s in range(len(self._procs)):
+            summary, max_rss = self._receive(s)
+            summaries.append(summary)
+            if max_rss is not None:
+                self.worker_max_rss.append(max_rss)
+        for p in self._procs:
+            p.join()
+        if summaries:
+            self.replenishment_summary = merge_summaries(summaries)
+        self._inboxes, self._outboxes, self._procs = [], [], []
+
+    def run(self, out_dir=".", owl_format="rdfxml", formats=("csv",)):
+        try:
+            for _ in range(self.steps):
+                self.step()
+        finally:
+            self.close(out_dir, owl_format)
+        if self.retention is not None:
+            self.retention.close()
+        print(f"[REPLENISHMENT] {format_summary(self.replenishment_summary)}")
+        write_reports(self.events, self.ts, Path(out_dir) / "report", formats)
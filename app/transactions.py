@@ -0,0 +1,113 @@
+import threading
+from contextlib import contextmanager
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+class Reservation:
+    def __init__(self, inventory, qty):
+        self.inventory = inventory
+        self.qty = qty
+        self.state = "open"  # -> "committed" | "aborted"
+
+
+class InventoryLedger:
+    """Thread-safe reserve/commit/abort on Inventory.AvailableQuantity.
+
+    Every inventory gets its own lock guarding its available-to-promise count
+    (on hand minus open reservations), so a reservation can never take more
+    than is there. Only that reservation step runs in parallel across books:
+    commits, restocks and any Order/Purchases writes go to the ontology under
+    the single onto_lock, which callers must also hold for any other ontology
+    mutation made from a worker thread. Never take an inventory lock while
+    holding onto_lock.
+
+    All stock changes must go through the ledger once it is in use; a direct
+    write to AvailableQuantity would not be seen by later reservations.
+    """
+
+    def __init__(self, onto):
+        self.onto = onto
+        self.onto_lock = threading.RLock()
+        self._registry_lock = threading.Lock()
+        self._locks = {}   # inventory name -> Lock
+        self._avail = {}   # inventory name -> available-to-promise qty
+
+    def _lock_for(self, inv):
+        lock = self._locks.get(inv.name)
+        if lock is None:
+            with self._registry_lock:
+                lock = self._locks.get(inv.name)
+                if lock is None:
+                    with self.onto_lock:
+                        self._avail[inv.name] = int(inv.AvailableQuantity)
+                    lock = self._locks[inv.name] = threading.Lock()
+        return lock
+
+    def available(self, inv):
+        with self._lock_for(inv):
+            return self._avail[inv.name]
+
+    def reserve(self, inv, qty):
+        """Hold qty units of inv; returns a Reservation, or None if short."""
+        qty = int(qty)
+        if qty <= 0:
+            raise ValueError("qty must be positive")
+        with self._lock_for(inv):
+            if self._avail[inv.name] < qty:
+                return None
+            self._avail[inv.name] -= qty
+        return Reservation(inv, qty)
+
+    def commit(self, res):
+        """Take the reserved units off the shelf; returns the new on-hand qty."""
+        self._close(res, "committed")
+        with self.onto_lock:
+            inv = res.inventory
+            inv.AvailableQuantity = int(inv.AvailableQuantity) - res.qty
+            return int(inv.AvailableQuantity)
+
+    def abort(self, res):
+        with self._lock_for(res.inventory):
+            self._close_locked(res, "aborted")
+            self._avail[res.inventory.name] += res.qty
+
+    def _close(self, res, state):
+        with self._lock_for(res.inventory):
+            self._close_locked(res, state)
+
+    def _close_locked(self, res, state):
+        # check-and-set under the inventory lock: a reservation closes once
+        if res.state != "open":
+            raise RuntimeError(f"Reservation already {res.state}")
+        res.state = state
+
+    @contextmanager
+    def transaction(self, inv, qty):
+        """Reserve, run the block, commit; abort if the block raises.
+
+        Raises InsufficientStock when the reservation cannot be made.
+        """
+        res = self.reserve(inv, qty)
+        if res is None:
+            raise InsufficientStock(f"{inv.name}: need {qty}, have {self.available(inv)}")
+        try:
+            yield res
+        except BaseException:
+            self.abort(res)
+            raise
+        self.commit(res)
+
+    def restock(self, inv, qty):
+        """Add qty units; returns the new on-hand qty."""
+        qty = int(qty)
+        lock = self._lock_for(inv)
+        # shelf first, then promise: a commit can never drive on-hand negative
+        with self.onto_lock:
+            inv.AvailableQuantity = int(inv.AvailableQuantity) + qty
+            after = int(inv.AvailableQuantity)
+        with lock:
+            self._avail[inv.name] += qty
+        return after
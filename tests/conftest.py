@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The app modules import each other as top-level modules (see app/run.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from ontology import build_ontology, seed_data  # noqa: E402
+
+
+@pytest.fixture
+def onto():
+    # owlready2 keeps one global world; start every test from a fresh store
+    o = build_ontology()
+    seed_data(o)
+    yield o
+    o.destroy()
+
+
+def pytest_addoption(parser):
+    parser.addoption("--run-slow", action="store_true", help="also run tests marked slow (soak checks)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: long-running soak check, skipped without --run-slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-slow"):
+        return
+    skip = pytest.mark.skip(reason="needs --run-slow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip)
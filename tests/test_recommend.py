@@ -0,0 +1,61 @@
+import random
+import threading
+
+import numpy as np
+
+from messaging import MessageBus, TOPIC_PURCHASE_OK
+from recommend import RecommendationIndex
+
+THREADS = 8
+ROUNDS = 500
+
+
+def buy(bus, customer, book):
+    bus.publish(TOPIC_PURCHASE_OK, {"customer_id": customer, "book_iri": book.iri, "qty": 1})
+
+
+def test_candidates_exclude_own_recent_books(onto):
+    bus = MessageBus()
+    rec = RecommendationIndex(onto, bus)
+    books = sorted(onto.Book.instances(), key=lambda b: b.name)
+    rng = random.Random(0)
+    for _ in range(300):  # enough co-purchases that every row is populated
+        buy(bus, f"Cust_{rng.randrange(6) + 1}", rng.choice(books))
+    rec.refresh()
+
+    for c in range(1, 7):
+        h = rec.hist[rec.customer_index(f"Cust_{c}")]
+        own = set(h[h >= 0].tolist())
+        idx, scores = rec.top_k_for(f"Cust_{c}")
+        assert own and idx.size
+        assert not own & set(idx.tolist())
+        assert np.all(np.diff(scores) <= 0)
+
+
+def test_concurrent_purchases_are_all_recorded(onto):
+    bus = MessageBus()
+    rec = RecommendationIndex(onto, bus)
+    before = float(rec.popularity.sum())
+    books = list(onto.Book.instances())
+    barrier = threading.Barrier(THREADS)
+
+    def buyer(t):
+        rng = random.Random(t)
+        barrier.wait()
+        for k in range(ROUNDS):
+            buy(bus, f"Cust_{t % 3 + 1}", rng.choice(books))
+            if k % 50 == 0:
+                rec.refresh()
+                rec.top_k_for(f"Cust_{t % 3 + 1}")
+
+    threads = [threading.Thread(target=buyer, args=(t,)) for t in range(THREADS)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    assert rec.popularity.sum() == before + THREADS * ROUNDS
+    assert int(rec._hist_pos.sum()) == int(before) + THREADS * ROUNDS
+    # every neighbour slot is either empty or a real book with a positive count
+    filled = rec.nbr >= 0
+    assert np.all(rec.nbr_w[filled] > 0) and np.all(rec.nbr[filled] < len(books))
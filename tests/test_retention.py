@@ -0,0 +1,80 @@
+import csv
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+from messaging import TOPIC_PURCHASE_OK
+from model import BookstoreModel
+
+
+def read_orders(archive):
+    with gzip.open(archive / "orders.csv.gz", "rt", newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def run_model(archive, **kwargs):
+    m = BookstoreModel(verbose=False, archive_dir=str(archive), **kwargs)
+    seeded = len(list(m.onto.Order.instances()))
+    ok = []
+    m.bus.subscribe(TOPIC_PURCHASE_OK, ok.append)
+    try:
+        for _ in range(m.steps):
+            m.step()
+        m.retention.close()
+        live = len(list(m.onto.Order.instances())) - seeded
+        return m, ok, live
+    finally:
+        m.onto.destroy()
+
+
+def test_archive_holds_exactly_one_run(tmp_path):
+    archive = tmp_path / "archive"
+    for _ in range(2):  # the second run must replace, not extend, the first
+        m, ok, live = run_model(archive, n_customers=6, steps=17, seed=5, retention_window=4)
+
+        # every successful purchase is archived once, including the Orders
+        # still live at the end, which stay in the ontology for the export
+        orders = read_orders(archive)
+        assert len(orders) == len(ok)
+        assert len({o["order"] for o in orders}) == len(orders)
+        assert live == len(ok) - m.retention.orders_compacted > 0
+
+        with gzip.open(archive / "events.jsonl.gz", "rt", encoding="utf-8") as f:
+            steps = [json.loads(line)["step"] for line in f]
+        assert len(steps) == m.events.total and steps == sorted(steps)
+        with gzip.open(archive / "inventory_timeseries.csv.gz", "rt", newline="", encoding="utf-8") as f:
+            assert [int(r["step"]) for r in csv.DictReader(f)] == list(range(m.steps + 1))
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc/self/statm")
+def test_retention_soak_memory_is_bounded(tmp_path):
+    # ~110 Orders per step. owlready2 keeps the last 65536 entities it created
+    # alive in a ring cache, so RSS climbs until ~step 600 whatever we destroy;
+    # measure only after that.
+    window, warmup, checkpoints, every = 10, 1000, 3, 300
+    m = BookstoreModel(n_customers=100, n_employees=2, steps=0, seed=3, n_books=120, verbose=False,
+                       retention_window=window, archive_dir=str(tmp_path / "archive"))
+    try:
+        for _ in range(warmup):
+            m.step()
+        rss = [current_rss_mb()]
+        for _ in range(checkpoints):
+            for _ in range(every):
+                m.step()
+            rss.append(current_rss_mb())
+            # in-memory history stays within two windows
+            assert len(m.ts) <= 2 * window
+            assert {e["step"] for e in m.events} <= set(range(m.step_idx - 2 * window, m.step_idx))
+            assert len(list(m.onto.Order.instances())) <= 2 * window * 100
+        assert rss[-1] - rss[0] < 5, f"RSS grew across checkpoints: {rss}"
+    finally:
+        m.onto.destroy()
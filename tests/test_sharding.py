@@ -0,0 +1,53 @@
+import pytest
+
+from ontology import build_ontology, seed_data, seed_slice
+from sharding import ShardedBookstoreModel, catalog_slices, partition_inventories
+
+
+def names(entities):
+    return sorted(e.name for e in entities)
+
+
+def test_slices_partition_the_store():
+    onto = build_ontology()
+    seed_data(onto)
+    owner = partition_inventories(onto, 2)
+    slices = catalog_slices(onto, owner, 2)
+    books, invs = names(onto.Book.instances()), names(onto.Inventory.instances())
+    emps, custs = names(onto.Employee.instances()), names(onto.Customer.instances())
+    orders = names(onto.Order.instances())
+    onto.destroy()
+
+    seen = {"books": [], "invs": [], "orders": []}
+    for s, spec in enumerate(slices):
+        part = build_ontology()
+        try:
+            seed_slice(part, spec)
+            owned = list(part.Inventory.instances())
+            assert owned and all(owner[inv.name] == s for inv in owned)
+            # every employee and customer, in the same order, so Emp_N / Cust_N resolve alike
+            assert [e.name for e in part.Employee.instances()] == [name for name, _ in spec["employees"]]
+            assert names(part.Employee.instances()) == emps and names(part.Customer.instances()) == custs
+            for e in part.Employee.instances():
+                assert set(e.WorksAt) <= set(owned)
+            for c in part.Customer.instances():
+                assert all(owner[part.search_one(type=part.Inventory, Stores=b).name] == s for b in c.Purchases)
+            seen["books"] += names(part.Book.instances())
+            seen["invs"] += names(owned)
+            seen["orders"] += names(part.Order.instances())
+        finally:
+            part.destroy()
+
+    assert sorted(seen["books"]) == books
+    assert sorted(seen["invs"]) == invs
+    assert sorted(seen["orders"]) == orders
+
+
+def test_shard_count_is_capped_with_a_warning():
+    with pytest.warns(RuntimeWarning, match="running 2 shards instead of 8"):
+        m = ShardedBookstoreModel(n_shards=8, steps=0, seed=1, verbose=False)
+    try:
+        assert m.n_shards == 2
+    finally:
+        m.close()
+        m.onto.destroy()
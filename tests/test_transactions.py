@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+from agents import InventoryManager
+from messaging import MessageBus, TOPIC_PURCHASE_OK, TOPIC_PURCHASE_FAIL
+from transactions import InsufficientStock
+
+THREADS = 8
+ROUNDS = 300
+RESTOCK_EVERY = 50
+RESTOCK_QTY = 3
+
+
+def test_concurrent_purchases_keep_stock_invariants(onto):
+    bus = MessageBus()
+    im = InventoryManager(onto, bus, verbose=False)
+    ok, fail = [], []
+    bus.subscribe(TOPIC_PURCHASE_OK, ok.append)
+    bus.subscribe(TOPIC_PURCHASE_FAIL, fail.append)
+
+    # three shared books so threads contend on the same inventories
+    books = sorted(onto.Book.instances(), key=lambda b: b.name)[:3]
+    invs = {b.iri: im._lookup(b.iri)[1] for b in books}
+    start = {iri: int(inv.AvailableQuantity) for iri, inv in invs.items()}
+    orders_before = len(list(onto.Order.instances()))
+    restocked = {iri: 0 for iri in invs}
+    low = {iri: q for iri, q in start.items()}  # lowest on-hand seen by a sampler
+    restock_lock = threading.Lock()
+    stop = threading.Event()
+    barrier = threading.Barrier(THREADS)
+
+    def buyer(t):
+        barrier.wait()
+        for k in range(ROUNDS):
+            book = books[(t + k) % len(books)]
+            im.handle_purchase({"customer_id": f"Cust_{t + 1}", "book_iri": book.iri, "qty": 1 + k % 2})
+            if k % RESTOCK_EVERY == 0:
+                im.ledger.restock(invs[book.iri], RESTOCK_QTY)
+                with restock_lock:
+                    restocked[book.iri] += RESTOCK_QTY
+
+    def sampler():
+        while not stop.is_set():
+            for iri, inv in invs.items():
+                with im.ledger.onto_lock:
+                    low[iri] = min(low[iri], int(inv.AvailableQuantity))
+
+    watch = threading.Thread(target=sampler)
+    watch.start()
+    workers = [threading.Thread(target=buyer, args=(t,)) for t in range(THREADS)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    stop.set()
+    watch.join()
+
+    assert len(ok) + len(fail) == THREADS * ROUNDS
+    assert fail, "the run should exhaust stock, or it proves nothing about overselling"
+    for iri, inv in invs.items():
+        sold = sum(p["qty"] for p in ok if p["book_iri"] == iri)
+        final = int(inv.AvailableQuantity)
+        assert low[iri] >= 0
+        assert final >= 0
+        assert final == start[iri] + restocked[iri] - sold
+        assert im.ledger.available(inv) == final  # no reservation left open
+    assert len(list(onto.Order.instances())) - orders_before == len(ok)
+
+
+def test_reservation_closes_exactly_once(onto):
+    im = InventoryManager(onto, MessageBus(), verbose=False)
+    inv = im._lookup(onto.Book("Book_HP1").iri)[1]
+    res = im.ledger.reserve(inv, 5)
+    winners = []
+
+    def commit():
+        try:
+            im.ledger.commit(res)
+            winners.append(1)
+        except RuntimeError:
+            pass
+
+    threads = [threading.Thread(target=commit) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert winners == [1]
+    assert int(inv.AvailableQuantity) == 45
+    with pytest.raises(RuntimeError):
+        im.ledger.abort(res)
+
+
+def test_transaction_aborts_on_error_and_refuses_oversell(onto):
+    im = InventoryManager(onto, MessageBus(), verbose=False)
+    inv = im._lookup(onto.Book("Book_1984").iri)[1]
+
+    with pytest.raises(KeyError):
+        with im.ledger.transaction(inv, 5):
+            raise KeyError("boom")
+    assert im.ledger.available(inv) == 20
+
+    with pytest.raises(InsufficientStock):
+        with im.ledger.transaction(inv, 21):
+            pass
+    assert int(inv.AvailableQuantity) == 20